@@ -0,0 +1,497 @@
+"""Compressed, indexed archive for long-term storage of raw LoRaTap frames
+
+An archive is two files:
+    NAME.lfa        pcap header, then lzma-compressed blocks of pcap records
+    NAME.lfa.idx    sqlite index of each block's time range, src nodes and packet_ids
+                    (as a bloom filter)
+
+Lookups only decompress the blocks holding matching frames, and any selection
+can be streamed back out as a standard pcap for Wireshark or record_packets.py.
+"""
+
+import argparse
+import datetime
+import hashlib
+import heapq
+import lzma
+import os
+import sqlite3
+import struct
+import sys
+import time
+from functools import lru_cache
+
+import pcap_utils
+
+MAGIC = b"LFA1"
+
+#      0-------------- 1---------------2---------------3--------------
+#    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+#  0 |                   Compressed Length (uint32)                    |
+#    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+#  4 |                      Frame Count (uint32)                       |
+#    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+#  8 /            raw lzma2-compressed pcap packet records             /
+BLOCK_HEADER = struct.Struct("<II")
+
+# blocks are raw lzma2 streams, the .xz container costs too much on the small
+# blocks live captures write. dict_size is fixed so reading doesn't need the preset
+LZMA_FILTER = {"id": lzma.FILTER_LZMA2, "dict_size": 1 << 23}
+
+# packet_ids are random, so they're indexed with a bloom filter per block rather
+# than a row per frame, which would take up nearly as much space as the frames
+BLOOM_BITS_PER_ID = 10
+BLOOM_HASHES = 7
+
+
+def frame_ids(record: bytes) -> tuple[int | None, int | None]:
+    """Pull the MeshPacket src and packet_id out of a pcap record without scapy"""
+    data = record[16:]
+    if len(data) < 15 or data[14] != 0x2B:  # not a meshtastic sync_word
+        return None, None
+    lt_length = struct.unpack_from(">H", data, 2)[0]  # LoRaTap header length
+    if len(data) < lt_length + 12:
+        return None, None
+    # MeshPacket starts with dst, src, packet_id as little-endian uint32
+    _, src, packet_id = struct.unpack_from("<III", data, lt_length)
+    return src, packet_id
+
+
+def bloom_hashes(packet_id: int, size: int):
+    """Bit positions for a packet_id in a bloom filter of size bits"""
+    digest = hashlib.blake2b(packet_id.to_bytes(4, "little"), digest_size=8).digest()
+    h1, h2 = struct.unpack("<II", digest)
+    return [(h1 + i * h2) % size for i in range(BLOOM_HASHES)]
+
+
+def bloom_filter(packet_ids: list[int]) -> bytes:
+    """Per-block set of packet_ids, about 1% false positives at 10 bits per id"""
+    bits = bytearray(max((len(packet_ids) * BLOOM_BITS_PER_ID + 7) // 8, 1))
+    size = len(bits) * 8  # bloom_contains only knows the byte length
+    for packet_id in packet_ids:
+        for bit in bloom_hashes(packet_id, size):
+            bits[bit // 8] |= 1 << (bit % 8)
+    return bytes(bits)
+
+
+def bloom_contains(bits: bytes, packet_id: int) -> bool:
+    size = len(bits) * 8
+    return all(bits[bit // 8] & (1 << (bit % 8)) for bit in bloom_hashes(packet_id, size))
+
+
+def radio_id(value: str | int) -> int:
+    """Accept node ids as ints, '!abcd1234' or '0xabcd1234'"""
+    if isinstance(value, int):
+        return value
+    return int(value.lstrip("!"), 16)
+
+
+class ArchiveWriter:
+    """Append frames to an archive, creating it if needed"""
+
+    def __init__(
+        self,
+        path: str,
+        block_size: int = 1 << 20,
+        preset: int = 6,
+        max_age: float | None = None,
+    ):
+        self.path = path
+        self.block_size = block_size  # uncompressed bytes per block
+        self.preset = preset
+        # seconds a frame can wait in memory before its block is written anyway
+        # smaller blocks compress worse, but live captures shouldn't sit unsaved
+        self.max_age = max_age
+        self.records = []
+        self.pending = 0
+        self.oldest = None  # when the first pending frame was added
+
+        self.index = sqlite3.connect(path + ".idx")
+        cur = self.index.cursor()
+        cur.execute("""
+            CREATE TABLE if not exists blocks (
+                block INTEGER PRIMARY KEY,
+                offset INTEGER,
+                length INTEGER,
+                frames INTEGER,
+                first_ts REAL,
+                last_ts REAL,
+                packet_filter BLOB)
+        """)
+        # the index is per block rather than per frame so it stays small next to
+        # the compressed frames. Lookups decompress candidate blocks and filter them
+        cur.execute("""
+            CREATE TABLE if not exists block_nodes (
+                src INTEGER,
+                block INTEGER,
+                PRIMARY KEY (src, block)) WITHOUT ROWID
+        """)
+        self.index.commit()
+
+        if os.path.exists(path) and os.path.getsize(path):
+            self.file = open(path, "r+b")
+            if self.file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a frame archive")
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(MAGIC + pcap_utils.make_header(l2type=270))
+        cur.execute("SELECT coalesce(max(block) + 1, 0) FROM blocks")
+        self.block = cur.fetchone()[0]
+
+    def add(self, record: bytes, timestamp: float):
+        """Add a pcap record, as made by pcap_utils.make_packet"""
+        if not self.records:
+            self.oldest = time.monotonic()
+        self.records.append((timestamp, record))
+        self.pending += len(record)
+        if self.pending >= self.block_size:
+            self.flush()
+        else:
+            self.flush_expired()
+
+    def flush_expired(self):
+        """Flush pending frames if they have waited longer than max_age"""
+        if (
+            self.max_age is not None
+            and self.records
+            and time.monotonic() - self.oldest >= self.max_age
+        ):
+            self.flush()
+
+    def add_pcap(self, filename: str) -> int:
+        """Add every packet from a pcap file, returning the number added"""
+        count = 0
+        with open(filename, "rb") as f:
+            byteorder, l2type = pcap_utils.read_header(f)
+            if l2type != 270:
+                raise ValueError(
+                    f"{filename} has link-layer type {l2type}, only LoRaTap (270) can be archived"
+                )
+            for timestamp, record in pcap_utils.read_packets(f, byteorder):
+                self.add(record, timestamp)
+                count += 1
+        return count
+
+    def flush(self):
+        """Compress pending frames into a block and index them"""
+        if not self.records:
+            return
+        compressed = lzma.compress(
+            b"".join(record for _, record in self.records),
+            format=lzma.FORMAT_RAW,
+            filters=[dict(LZMA_FILTER, preset=self.preset)],
+        )
+        offset = self.file.tell()
+        self.file.write(BLOCK_HEADER.pack(len(compressed), len(self.records)))
+        self.file.write(compressed)
+        self.file.flush()
+
+        timestamps = [timestamp for timestamp, _ in self.records]
+        ids = [frame_ids(record) for _, record in self.records]
+        packet_ids = [packet_id for _, packet_id in ids if packet_id is not None]
+        cur = self.index.cursor()
+        cur.execute(
+            "INSERT INTO blocks VALUES(?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.block,
+                offset,
+                BLOCK_HEADER.size + len(compressed),
+                len(self.records),
+                min(timestamps),
+                max(timestamps),
+                bloom_filter(packet_ids),
+            ),
+        )
+        cur.executemany(
+            "INSERT OR IGNORE INTO block_nodes VALUES(?, ?)",
+            ((src, self.block) for src in {src for src, _ in ids if src is not None}),
+        )
+        self.index.commit()
+
+        self.block += 1
+        self.records = []
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader:
+    """Look up and extract frames from an archive"""
+
+    def __init__(self, path: str, cache_blocks: int = 16):
+        self.path = path
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a frame archive")
+        self.header = self.file.read(24)
+        self.index = sqlite3.connect(f"file:{path}.idx?mode=ro", uri=True)
+        # keep recently used blocks decompressed for runs of nearby lookups
+        self.read_block = lru_cache(maxsize=cache_blocks)(self._read_block)
+
+    def _read_block(self, block: int) -> list[bytes]:
+        cur = self.index.cursor()
+        cur.execute("SELECT offset FROM blocks WHERE block = ?", (block,))
+        (offset,) = cur.fetchone()
+        self.file.seek(offset)
+        length, frames = BLOCK_HEADER.unpack(self.file.read(BLOCK_HEADER.size))
+        data = lzma.decompress(
+            self.file.read(length), format=lzma.FORMAT_RAW, filters=[LZMA_FILTER]
+        )
+
+        # split the records back apart using their captured length
+        records = []
+        position = 0
+        for _ in range(frames):
+            captured_length = struct.unpack_from("I", data, position + 8)[0]
+            end = position + 16 + captured_length
+            records.append(data[position:end])
+            position = end
+        return records
+
+    def candidate_blocks(
+        self,
+        src: str | int | None = None,
+        packet_id: str | int | None = None,
+        since: float | None = None,
+        until: float | None = None,
+    ):
+        """Iterate (block, first_ts, last_ts) of blocks that may hold matching frames"""
+        conditions = []
+        params = []
+        if src is not None:
+            conditions.append("block IN (SELECT block FROM block_nodes WHERE src = ?)")
+            params.append(radio_id(src))
+        if since is not None:
+            conditions.append("last_ts >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("first_ts < ?")
+            params.append(until)
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        # time queries come out in time order, everything else in archive order
+        # so each block only needs decompressing once
+        order = "first_ts, block" if since is not None or until is not None else "block"
+        cur = self.index.execute(
+            f"SELECT block, first_ts, last_ts, packet_filter FROM blocks {where} "
+            f"ORDER BY {order}",
+            params,
+        )
+        for block, first_ts, last_ts, packet_filter in cur:
+            if packet_id is None or bloom_contains(packet_filter, radio_id(packet_id)):
+                yield block, first_ts, last_ts
+
+    def block_matches(
+        self,
+        block: int,
+        src: str | int | None = None,
+        packet_id: str | int | None = None,
+        since: float | None = None,
+        until: float | None = None,
+    ):
+        """Yield (timestamp, block, position, record) for matching frames in a block"""
+        src = None if src is None else radio_id(src)
+        packet_id = None if packet_id is None else radio_id(packet_id)
+        for position, record in enumerate(self.read_block(block)):
+            seconds, microseconds = struct.unpack_from("II", record, 0)
+            timestamp = seconds + microseconds / 1e6
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp >= until:
+                continue
+            if src is not None or packet_id is not None:
+                frame_src, frame_packet_id = frame_ids(record)
+                if src is not None and frame_src != src:
+                    continue
+                if packet_id is not None and frame_packet_id != packet_id:
+                    continue
+            yield timestamp, block, position, record
+
+    def matches(self, **query):
+        """Yield (timestamp, block, position, record) for every matching frame.
+
+        Blocks are streamed one at a time. For time queries, blocks with overlapping
+        time ranges (e.g. from pcaps captured side by side) are merged by timestamp
+        """
+        timed = query.get("since") is not None or query.get("until") is not None
+        cluster = []
+        cluster_end = None
+        for block, first_ts, last_ts in self.candidate_blocks(**query):
+            if cluster and (not timed or first_ts > cluster_end):
+                yield from self.merge_blocks(cluster, query)
+                cluster = []
+            cluster_end = last_ts if not cluster else max(cluster_end, last_ts)
+            cluster.append(block)
+        if cluster:
+            yield from self.merge_blocks(cluster, query)
+
+    def merge_blocks(self, blocks: list[int], query: dict):
+        return heapq.merge(
+            *(self.block_matches(block, **query) for block in blocks),
+            key=lambda match: match[0],
+        )
+
+    def find(self, **query):
+        """Yield (block, position, timestamp) of every matching frame"""
+        for timestamp, block, position, _ in self.matches(**query):
+            yield block, position, timestamp
+
+    def frame(self, block: int, position: int) -> bytes:
+        """A single pcap record"""
+        return self.read_block(block)[position]
+
+    def frames(self, **query):
+        """Yield (timestamp, record) for every frame matching a find() query"""
+        for timestamp, _, _, record in self.matches(**query):
+            yield timestamp, record
+
+    def export(self, out, **query) -> int:
+        """Stream matching frames to a file object as a standard pcap"""
+        out.write(self.header)
+        count = 0
+        for _, record in self.frames(**query):
+            out.write(record)
+            count += 1
+        out.flush()
+        return count
+
+    def info(self) -> dict:
+        cur = self.index.cursor()
+        cur.execute(
+            "SELECT count(*), sum(frames), sum(length), min(first_ts), max(last_ts) FROM blocks"
+        )
+        blocks, frames, size, first, last = cur.fetchone()
+        return {
+            "blocks": blocks,
+            "frames": frames or 0,
+            "compressed_bytes": size or 0,
+            "first": first,
+            "last": last,
+        }
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compact(path: str, block_size: int = 1 << 20, preset: int = 6) -> int:
+    """Rewrite an archive into full-size blocks, returning the new block count.
+
+    Live captures flush small blocks by age, which compress poorly. Don't compact
+    an archive that is still being written to
+    """
+    temp = path + ".compact"
+    for leftover in (temp, temp + ".idx"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    with ArchiveReader(path) as reader, ArchiveWriter(temp, block_size, preset) as writer:
+        for timestamp, record in reader.frames():
+            writer.add(record, timestamp)
+        blocks = writer.block
+    os.replace(temp, path)
+    os.replace(temp + ".idx", path + ".idx")
+    return blocks
+
+
+def parse_time(value: str) -> float:
+    """Unix timestamps or ISO dates like 2025-06-03 or 2025-06-03T14:00"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+parser = argparse.ArgumentParser(
+    description="Stores raw pcap captures in a compressed archive with an index for fast lookups."
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+pack_parser = subparsers.add_parser("pack", help="Add pcap files to an archive")
+pack_parser.add_argument("archive")
+pack_parser.add_argument("pcaps", nargs="+")
+pack_parser.add_argument(
+    "--block-size", type=int, default=1 << 20, help="Uncompressed bytes per block."
+)
+pack_parser.add_argument(
+    "--preset", type=int, default=6, help="lzma compression level, 0-9."
+)
+
+compact_parser = subparsers.add_parser(
+    "compact", help="Merge small blocks, e.g. from live captures, into full-size ones"
+)
+compact_parser.add_argument("archive")
+compact_parser.add_argument(
+    "--block-size", type=int, default=1 << 20, help="Uncompressed bytes per block."
+)
+compact_parser.add_argument(
+    "--preset", type=int, default=6, help="lzma compression level, 0-9."
+)
+
+export_parser = subparsers.add_parser(
+    "export", help="Write matching frames out as a pcap file"
+)
+export_parser.add_argument("archive")
+export_parser.add_argument(
+    "-o", "--out", default="-", help="pcap output location. Supports '-' for stdout."
+)
+export_parser.add_argument("--src", help="Node id, e.g. !abcd1234")
+export_parser.add_argument("--packet-id", help="Packet id, e.g. 0x1234abcd")
+export_parser.add_argument("--since", type=parse_time, help="Start time, inclusive.")
+export_parser.add_argument("--until", type=parse_time, help="End time, exclusive.")
+
+info_parser = subparsers.add_parser("info", help="Summarize an archive")
+info_parser.add_argument("archive")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        with ArchiveWriter(args.archive, args.block_size, args.preset) as writer:
+            for pcap in args.pcaps:
+                count = writer.add_pcap(pcap)
+                print(f"Archived {count} packets from {pcap}")
+
+    elif args.command == "compact":
+        before = os.path.getsize(args.archive) + os.path.getsize(args.archive + ".idx")
+        blocks = compact(args.archive, args.block_size, args.preset)
+        after = os.path.getsize(args.archive) + os.path.getsize(args.archive + ".idx")
+        print(f"Compacted into {blocks} blocks, {before} -> {after} bytes")
+
+    elif args.command == "export":
+        query = {
+            "src": args.src,
+            "packet_id": args.packet_id,
+            "since": args.since,
+            "until": args.until,
+        }
+        with ArchiveReader(args.archive) as reader:
+            if args.out == "-":
+                count = reader.export(sys.stdout.buffer, **query)
+            else:
+                with open(args.out, "wb") as out:
+                    count = reader.export(out, **query)
+        print(f"Exported {count} packets", file=sys.stderr)
+
+    elif args.command == "info":
+        with ArchiveReader(args.archive) as reader:
+            info = reader.info()
+        for key, value in info.items():
+            if key in ("first", "last") and value is not None:
+                value = datetime.datetime.fromtimestamp(value).isoformat()
+            print(f"{key}: {value}")
@@ -1,3 +1,4 @@
+import math
 import sqlite3
 
 
@@ -37,9 +38,136 @@ class Databse(sqlite3.Connection):
                 _id PRIMARY KEY,
                 {",".join(nodeinfo_cols)})
         """)
+        # typed time series pulled out of TELEMETRY_APP and POSITION_APP packets
+        # keyed by packet so rebroadcasts of the same packet are only counted once
+        cur.execute("""
+            CREATE TABLE if not exists telemetry (
+                _timestamp,
+                src,
+                packet_id,
+                metric TEXT,
+                value REAL,
+                PRIMARY KEY (src, packet_id, metric))
+        """)
+
+        cur.execute("""
+            CREATE TABLE if not exists positions (
+                _timestamp,
+                src,
+                packet_id,
+                latitude REAL,
+                longitude REAL,
+                altitude REAL,
+                PRIMARY KEY (src, packet_id))
+        """)
+
+        # downsampled series, updated as data comes in. avg is total/count
+        cur.execute("""
+            CREATE TABLE if not exists rollups (
+                src,
+                metric TEXT,
+                period TEXT,
+                bucket INTEGER,
+                count INTEGER,
+                min REAL,
+                max REAL,
+                total REAL,
+                PRIMARY KEY (src, metric, period, bucket))
+        """)
         self.commit()
         return
 
+    # rollup period names and their length in seconds
+    rollup_periods = {"1m": 60, "1h": 3600, "1d": 86400}
+
+    def update_rollups(self, src: str, timestamp: float, metrics: dict):
+        """Fold new metric values into every rollup period. Does not commit."""
+        cur = self.cursor()
+        rows = [
+            {
+                "src": src,
+                "metric": metric,
+                "period": period,
+                "bucket": int(timestamp // seconds * seconds),
+                "value": value,
+            }
+            for period, seconds in self.rollup_periods.items()
+            for metric, value in metrics.items()
+        ]
+        cur.executemany(
+            """
+            INSERT INTO rollups(src, metric, period, bucket, count, min, max, total)
+            VALUES(:src, :metric, :period, :bucket, 1, :value, :value, :value)
+            ON CONFLICT(src, metric, period, bucket) DO UPDATE SET
+                count = count + 1,
+                min = min(min, excluded.min),
+                max = max(max, excluded.max),
+                total = total + excluded.total
+            """,
+            rows,
+        )
+
+    def insert_telemetry(self, src: str, packet_id: str, timestamp: str, appdata: dict):
+        """
+        Record every numeric metric of a TELEMETRY_APP payload, e.g. deviceMetrics.batteryLevel
+
+        Rebroadcasts of an already recorded packet are ignored.
+        """
+        metrics = {}
+        for group, values in appdata.items():
+            if not isinstance(values, dict):
+                continue  # the packet's own time field
+            for name, value in values.items():
+                if isinstance(value, str):
+                    # MessageToDict writes 64-bit integers as strings
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        continue
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                # NaN/Infinity would be stored as NULL and wipe out the rollup buckets
+                if math.isfinite(value):
+                    metrics[f"{group}.{name}"] = value
+
+        cur = self.cursor()
+        new_metrics = {}
+        for metric, value in metrics.items():
+            cur.execute(
+                "INSERT OR IGNORE INTO telemetry VALUES(?, ?, ?, ?, ?)",
+                (timestamp, src, packet_id, metric, value),
+            )
+            if cur.rowcount:
+                new_metrics[metric] = value
+        self.update_rollups(src, float(timestamp), new_metrics)
+        self.commit()
+
+    def insert_position(self, src: str, packet_id: str, timestamp: str, appdata: dict):
+        """
+        Record a POSITION_APP payload, converting coordinates to degrees
+
+        Rebroadcasts of an already recorded packet are ignored.
+        """
+        if "latitudeI" not in appdata or "longitudeI" not in appdata:
+            return  # position was withheld
+        position = {
+            "latitude": appdata["latitudeI"] / 1e7,
+            "longitude": appdata["longitudeI"] / 1e7,
+            "altitude": appdata.get("altitude"),
+        }
+
+        cur = self.cursor()
+        cur.execute(
+            "INSERT OR IGNORE INTO positions VALUES(?, ?, ?, ?, ?, ?)",
+            (timestamp, src, packet_id, *position.values()),
+        )
+        if cur.rowcount:
+            metrics = {
+                f"position.{k}": v for k, v in position.items() if v is not None
+            }
+            self.update_rollups(src, float(timestamp), metrics)
+        self.commit()
+
     def insert(
         self: sqlite3.Connection,
         table: str,
@@ -55,9 +55,9 @@ def make_header(l2type: int = 270):
     return header
 
 
-def make_packet(data: bytes):
+def make_packet(data: bytes, timestamp: float | None = None):
     """Convert incoming data bytes to a pcap-style packet.
-    Uses current system time for timestamps
+    Uses current system time for timestamps unless one is given
     """
     #      0-------------- 1---------------2---------------3--------------
     #      0 1 2 3 4 5 6 7 0 1 2 3 4 5 6 7 0 1 2 3 4 5 6 7 0 1 2 3 4 5 6 7
@@ -80,8 +80,10 @@ def make_packet(data: bytes):
     captured_length = min(length, 1024)
 
     # split apart seconds and microseconds
-    seconds = int(time.time())
-    microseconds = int((time.time() - seconds) * 1e6)
+    if timestamp is None:
+        timestamp = time.time()
+    seconds = int(timestamp)
+    microseconds = int((timestamp - seconds) * 1e6)
 
     struct.pack_into("I", packet_header, 0, seconds)  # timestamp
     struct.pack_into("I", packet_header, 4, microseconds)  # timestamp
@@ -89,3 +91,36 @@ def make_packet(data: bytes):
     struct.pack_into("I", packet_header, 12, length)  # original packet length
 
     return packet_header + data
+
+
+def read_header(file) -> tuple[str, int]:
+    """Read a PCAP header and return the struct byte order its records use
+    and the link-layer type
+    """
+    header = file.read(24)
+    if len(header) < 24:
+        raise ValueError("Not a pcap file, header too short")
+    for byteorder in "<>":
+        if struct.unpack_from(byteorder + "I", header, 0)[0] == 0xA1B2C3D4:
+            # link-layer type is the low 16 bits, the rest is FCS info
+            l2type = struct.unpack_from(byteorder + "I", header, 20)[0] & 0xFFFF
+            return byteorder, l2type
+    raise ValueError("Not a microsecond pcap file, bad magic number")
+
+
+def read_packets(file, byteorder: str = "="):
+    """Yield (timestamp, record) for each packet in a pcap file after the header.
+
+    record is the packet in the same layout make_packet produces, header included
+    """
+    while True:
+        packet_header = file.read(16)
+        if len(packet_header) < 16:
+            return
+        fields = struct.unpack(byteorder + "IIII", packet_header)
+        seconds, microseconds, captured_length, _ = fields
+        data = file.read(captured_length)
+        if len(data) < captured_length:
+            return  # truncated capture
+        # make_packet uses native byte order
+        yield seconds + microseconds / 1e6, struct.pack("IIII", *fields) + data
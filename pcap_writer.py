@@ -1,11 +1,12 @@
 import argparse
 import datetime
 import sys
+import time
 
 import serial
 import serial.tools.list_ports
 
-import pcap_utils
+from sinks import DROP_POLICIES, Dispatcher, sink_from_spec
 
 parser = argparse.ArgumentParser(
     description="Reads LoRa Packets from a LoRa Sniffer. Can generate wireshark-compatible pcap packets."
@@ -16,22 +17,31 @@ parser.add_argument(
 parser.add_argument(
     "-o",
     "--out",
-    dest="outfile",
-    help="Specify the output file location. Defaults to timestamped pcap files. Supports '-' for stdout.",
+    dest="outputs",
+    action="append",
+    help="Specify an output, can be repeated. Defaults to timestamped pcap files. Supports '-' for stdout, "
+    "'fifo:PATH' for a named pipe, 'sqlite:PATH' for a database and 'jsonl:PATH' for JSON lines "
+    "and 'archive:PATH' for a compressed frame archive.",
+)
+parser.add_argument(
+    "--queue-size",
+    type=int,
+    default=1000,
+    help="Frames buffered per output before the drop policy applies.",
+)
+parser.add_argument(
+    "--drop-policy",
+    choices=DROP_POLICIES,
+    default="drop-newest",
+    help="What to do when an output can't keep up.",
 )
 
 args = parser.parse_args()
 
 # handle outputs
-if args.outfile == "-":  # want stdout
-    outfile = None
-    stdout = True
-elif args.outfile:
-    outfile = args.outfile
-    stdout = False
-else:
-    outfile = f"output-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.pcap"
-    stdout = False
+outputs = args.outputs or [
+    f"output-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.pcap"
+]
 
 
 ser = serial.Serial()
@@ -58,26 +68,24 @@ except serial.serialutil.SerialException:
     print("Specify the desired port with -p")
     exit(1)
 
-# write the header to the output file or stdout
-header = pcap_utils.make_header(l2type=270)  # LoRaTap is link-layer type 270
-if stdout:
-    sys.stdout.buffer.write(header)
-    sys.stdout.buffer.flush()
-else:
-    open(outfile, "wb").write(header)
+# each output gets its own queue and thread, so a slow one can't hold up the others
+dispatcher = Dispatcher(
+    [sink_from_spec(spec) for spec in outputs], args.queue_size, args.drop_policy
+)
 
 # now we wait for incoming packets
 while True:
     try:
         data = ser.read_until(b"\xcf\xcf")  # custom EOF bytes, must match arduino code
         data = data[:-2]  # remove EOF bytes
-        packet = pcap_utils.make_packet(data)
-        if stdout:
-            sys.stdout.buffer.write(packet)
-            sys.stdout.buffer.flush()
-        else:
-            open(outfile, "ab").write(packet)
+        dispatcher.dispatch(data, time.time())
     except KeyboardInterrupt:
-        print("\nexiting")
+        print("\nexiting", file=sys.stderr)
         ser.close()
+        dispatcher.close(timeout=5)
+        for name, stats in dispatcher.stats().items():
+            print(
+                f"{name}: {stats.written} written, {stats.dropped} dropped, {stats.errors} errors",
+                file=sys.stderr,
+            )
         exit()
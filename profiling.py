@@ -0,0 +1,193 @@
+"""Profiling hooks for finding where packet processing time goes
+
+Wrap any capture processing in a Profiler to get time per scapy layer class and
+per function, a flamegraph-compatible stack file and a summary table:
+
+    with Profiler("profile") as prof:
+        prof.packets = len(sniff(offline="capture.pcap", prn=process))
+
+Writes profile.folded (for flamegraph.pl or speedscope), profile.json (for
+comparing against later runs) and profile.pstats in cprofile mode.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from scapy.packet import Packet
+
+
+def frame_name(frame) -> str:
+    """module:Class.function name for a stack frame"""
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def frame_layer(frame) -> str | None:
+    """Name of the scapy layer class a frame is running a method of, if any"""
+    if "self" not in frame.f_code.co_varnames:
+        return None
+    instance = frame.f_locals.get("self")
+    if isinstance(instance, Packet):
+        return type(instance).__name__
+    return None
+
+
+class StackSampler(threading.Thread):
+    """Periodically samples another thread's stack.
+
+    Much lower overhead than cProfile, and unlike cProfile it knows which layer
+    instance a generic Packet method (e.g. Packet.dissect) was running for
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        super().__init__(name="StackSampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # "outer;...;inner" -> samples
+        self.layers = Counter()  # innermost layer class -> samples
+        self.self_time = Counter()  # function -> samples as the innermost frame
+        self.total_time = Counter()  # function -> samples anywhere on the stack
+        self.samples = 0
+        self.running = threading.Event()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        layer = None
+        while frame is not None:
+            stack.append(frame_name(frame))
+            if layer is None:
+                layer = frame_layer(frame)
+            frame = frame.f_back
+        if not stack:
+            return
+        stack.reverse()
+        self.samples += 1
+        self.stacks[";".join(stack)] += 1
+        self.layers[layer or "(outside scapy layers)"] += 1
+        self.self_time[stack[-1]] += 1
+        for name in set(stack):
+            self.total_time[name] += 1
+
+    def run(self):
+        self.running.set()
+        while self.running.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running.clear()
+        self.join()
+
+
+class Profiler:
+    """Context manager that profiles the code run inside it.
+
+    mode "sample" only runs the stack sampler, "cprofile" also runs cProfile for
+    exact call counts at the cost of much more overhead
+    """
+
+    def __init__(
+        self,
+        prefix: str = "profile",
+        mode: str = "sample",
+        interval: float = 0.001,
+        baseline: str | None = None,
+        top: int = 20,
+    ):
+        assert mode in ["sample", "cprofile"]
+        self.prefix = prefix
+        self.mode = mode
+        self.interval = interval
+        self.baseline = baseline
+        self.top = top
+        self.packets = 0  # set by the caller for per-packet numbers
+
+    def __enter__(self):
+        self.sampler = StackSampler(threading.get_ident(), self.interval)
+        self.cprofile = cProfile.Profile() if self.mode == "cprofile" else None
+        self.sampler.start()
+        self.sampler.running.wait()
+        self.start = time.perf_counter()
+        if self.cprofile:
+            self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.cprofile:
+            self.cprofile.disable()
+        self.elapsed = time.perf_counter() - self.start
+        self.sampler.stop()
+        self.write()
+        print(self.report(), file=sys.stderr)
+        return False
+
+    def summary(self) -> dict:
+        samples = max(self.sampler.samples, 1)
+        return {
+            "elapsed": self.elapsed,
+            "packets": self.packets,
+            "us_per_packet": self.elapsed / self.packets * 1e6 if self.packets else None,
+            "samples": self.sampler.samples,
+            # fraction of samples, so runs of different lengths are comparable
+            "layers": {k: v / samples for k, v in self.sampler.layers.most_common()},
+            "self": {k: v / samples for k, v in self.sampler.self_time.most_common()},
+            "total": {k: v / samples for k, v in self.sampler.total_time.most_common()},
+        }
+
+    def write(self):
+        with open(f"{self.prefix}.folded", "w") as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(f"{self.prefix}.json", "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        if self.cprofile:
+            self.cprofile.dump_stats(f"{self.prefix}.pstats")
+
+    def report(self) -> str:
+        """Summary table, with changes against the baseline run if there is one"""
+        summary = self.summary()
+        baseline = {}
+        if self.baseline:
+            with open(self.baseline) as f:
+                baseline = json.load(f)
+
+        def table(title: str, key: str) -> list[str]:
+            lines = [f"{title:<60} {'share':>7} {'change':>8}"]
+            for name, share in list(summary[key].items())[: self.top]:
+                line = f"{name[-60:]:<60} {share:>7.1%}"
+                if name in baseline.get(key, {}):
+                    line += f" {share - baseline[key][name]:>+8.1%}"
+                lines.append(line)
+            return lines + [""]
+
+        lines = [
+            f"Profiled {summary['elapsed']:.2f}s, {summary['samples']} samples, "
+            f"{summary['packets']} packets",
+        ]
+        if summary["us_per_packet"]:
+            line = f"{summary['us_per_packet']:.0f} us/packet"
+            if baseline.get("us_per_packet"):
+                line += f" ({summary['us_per_packet'] / baseline['us_per_packet'] - 1:+.1%} vs baseline)"
+            lines.append(line)
+        lines.append("")
+        lines += table("Layer class", "layers")
+        lines += table("Function (self time)", "self")
+        lines += table("Function (including callees)", "total")
+
+        if self.cprofile:
+            stream = io.StringIO()
+            stats = pstats.Stats(self.cprofile, stream=stream)
+            stats.sort_stats("tottime").print_stats(self.top)
+            lines.append(stream.getvalue())
+            lines.append(f"Exact call counts in {self.prefix}.pstats")
+        lines.append(f"Stacks for flamegraphs in {self.prefix}.folded")
+        return "\n".join(lines)
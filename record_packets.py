@@ -1,10 +1,12 @@
 import argparse
 import json
 import sys
+from contextlib import nullcontext
 
 from scapy.all import sniff
 
 from db_tools import Databse
+from profiling import Profiler
 from scapy_meshtastic import LoRaTap, MeshApp, MeshPacket, MeshPayload, MeshText, pb
 
 parser = argparse.ArgumentParser(
@@ -12,11 +14,28 @@ parser = argparse.ArgumentParser(
 )
 
 parser.add_argument("filename")
-
-args = parser.parse_args()
+parser.add_argument(
+    "--profile",
+    nargs="?",
+    const="profile",
+    metavar="PREFIX",
+    help="Profile processing and write PREFIX.folded/.json stack and summary files.",
+)
+parser.add_argument(
+    "--profile-mode",
+    choices=["sample", "cprofile"],
+    default="sample",
+    help="cprofile adds exact call counts but slows processing down a lot.",
+)
+parser.add_argument(
+    "--profile-baseline",
+    metavar="JSON",
+    help="A previous PREFIX.json to compare the profile against.",
+)
 
 
-def process_packet(pkt):
+def decode_packet(pkt) -> dict | None:
+    """Flatten a decoded packet into a row for the data table"""
     # LoRaTap -> MeshPacket -> MeshPayload -> MeshApp OR MeshText
 
     try:
@@ -42,36 +61,73 @@ def process_packet(pkt):
     if pkt.haslayer(MeshPayload):  # portnum, want_response, request/reply ids
         packet_data["payload"] = json.dumps(pkt[MeshPayload].fields)
 
-    if pkt.haslayer(MeshApp):  # app data including node update logic
+    if pkt.haslayer(MeshApp):  # app data
         packet_data["appname"] = pkt.appname.decode()
         packet_data["appdata"] = json.dumps(pkt.appdata)
 
+    elif pkt.haslayer(MeshText):  # plain old text message
+        packet_data["appname"] = pkt.appname.decode()
+        packet_data["appdata"] = json.dumps(pkt[MeshText].appdata.decode())
+
+    return packet_data
+
+
+def process_packet(pkt, db: Databse):
+    packet_data = decode_packet(pkt)
+    if packet_data is None:
+        return
+
+    if pkt.haslayer(MeshApp):  # node update logic
         # update the node table
         if pkt.portnum == pb.portnums_pb2.NODEINFO_APP:
             nodeinfo = pkt.appdata
             nodeinfo.update({"_id": "!" + hex(pkt.src)[2:]})
             db.insert("nodes", nodeinfo, on_confict="REPLACE")
 
-    elif pkt.haslayer(MeshText):  # plain old text message
-        packet_data["appname"] = pkt.appname.decode()
-        packet_data["appdata"] = json.dumps(pkt[MeshText].appdata.decode())
+        # time series for charting
+        elif pkt.portnum == pb.portnums_pb2.TELEMETRY_APP:
+            db.insert_telemetry(
+                packet_data["src"],
+                packet_data["packet_id"],
+                packet_data["_timestamp"],
+                pkt.appdata,
+            )
+        elif pkt.portnum == pb.portnums_pb2.POSITION_APP:
+            db.insert_position(
+                packet_data["src"],
+                packet_data["packet_id"],
+                packet_data["_timestamp"],
+                pkt.appdata,
+            )
 
     db.insert("data", packet_data, on_confict="IGNORE")
 
 
-db = Databse("database.db")
-
-
 if __name__ == "__main__":
+    args = parser.parse_args()
+    db = Databse("database.db")
+    if args.profile:
+        profiler = Profiler(args.profile, args.profile_mode, baseline=args.profile_baseline)
+    else:
+        profiler = nullcontext()
+
     if args.filename == "-":
         print("Processing from stdin")
         try:
-            sniff(offline=sys.stdin.buffer, prn=process_packet)
+            with profiler:
+                s = sniff(
+                    offline=sys.stdin.buffer, prn=lambda pkt: process_packet(pkt, db)
+                )
+                if args.profile:
+                    profiler.packets = len(s)
         except KeyboardInterrupt:
             print("Exiting")
         finally:
             db.close()
 
     elif args.filename:
-        s = sniff(offline=args.filename, prn=process_packet)
+        with profiler:
+            s = sniff(offline=args.filename, prn=lambda pkt: process_packet(pkt, db))
+            if args.profile:
+                profiler.packets = len(s)
         print(f"Processed {len(s)} packets")
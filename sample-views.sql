@@ -40,4 +40,24 @@ group by
 	src,
 	packet_id
 order by
-	frametime asc
+	frametime asc;
+
+-- RollupView source
+
+CREATE VIEW RollupView as
+SELECT
+	r.src,
+	nodes.longName,
+	r.metric,
+	r.period,
+	datetime(r.bucket, 'unixepoch') bucket_start,
+	r.count,
+	r.min,
+	r.max,
+	r.total / r.count avg
+from
+	rollups r
+LEFT JOIN nodes on
+	nodes._id = r.src
+order by
+	r.bucket asc;
@@ -17,9 +17,10 @@ Implements LoRaTap decoding and all the layers down to meshtastic app usage
 import base64
 
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from google.protobuf.json_format import MessageToDict
+from google.protobuf.json_format import MessageToDict, ParseDict
 from google.protobuf.message import DecodeError
 from meshtastic import protobuf as pb
+from scapy.compat import bytes_encode
 from scapy.config import conf
 from scapy.fields import (
     BitEnumField,
@@ -157,12 +158,14 @@ class MeshPacket(Packet):
     def post_build(self, pkt, pay):
         # and reassemble the flags afterwards
         new_flags = (
-            (self._hop_limit << 0)
-            | (self._hop_start << 5)
-            | (self._want_ack << 3)
-            | (self._via_mqtt << 4)
+            ((self.hop_limit & 0x07) << 0)
+            | ((self.hop_start & 0x07) << 5)
+            | ((self.want_ack & 0x01) << 3)
+            | ((self.via_mqtt & 0x01) << 4)
         )
         self.flags = new_flags
+        # flags is the 13th byte, after dst, src and packet_id
+        pkt = pkt[:12] + bytes([new_flags]) + pkt[13:]
         return super().post_build(pkt, pay)
 
 
@@ -271,6 +274,30 @@ class MeshPayload(Packet):
     def pre_dissect(self, s):
         return self.decrypt(s)
 
+    def self_build(self):
+        # the fields are only a view of the Data protobuf, which post_build assembles
+        return b""
+
+    def post_build(self, pkt, pay):
+        # rebuild the Data protobuf around the app payload and encrypt it
+        # AES-CTR is symmetric, so decrypt() doubles as encrypt
+        subpacket = pb.mesh_pb2.Data(portnum=self.portnum, payload=pay)
+        if self.want_response is not None:
+            subpacket.want_response = bool(self.want_response)
+        if self.dst is not None:
+            subpacket.dest = self.dst
+        if self.src is not None:
+            subpacket.source = self.src
+        if self.request_id is not None:
+            subpacket.request_id = self.request_id
+        if self.reply_id is not None:
+            subpacket.reply_id = self.reply_id
+        if self.emoji is not None:
+            subpacket.emoji = self.emoji
+        if self.bitfield is not None:
+            subpacket.bitfield = self.bitfield
+        return self.decrypt(subpacket.SerializeToString())
+
     def do_dissect(self, s):
         subpacket = pb.mesh_pb2.Data()
         try:
@@ -297,6 +324,10 @@ class MeshText(Packet):
         self.appdata = s.decode()
         return
 
+    def self_build(self):
+        # only the message text goes over the air, dissected packets hold a str
+        return bytes_encode(self.appdata)
+
 
 class MeshApp(Packet):
     # Non-text message payloads with special behavior per-portnum
@@ -331,6 +362,25 @@ class MeshApp(Packet):
         except DecodeError:
             raise DecodeError(f"Could not unpack meshtastic app payload for {port=}")
 
+    # protobuf messages used to serialize appdata when building packets
+    pb_messages = {
+        pb.portnums_pb2.NODEINFO_APP: pb.mesh_pb2.User,
+        pb.portnums_pb2.POSITION_APP: pb.mesh_pb2.Position,
+        pb.portnums_pb2.TELEMETRY_APP: pb.telemetry_pb2.Telemetry,
+        pb.portnums_pb2.STORE_FORWARD_APP: pb.storeforward_pb2.StoreAndForward,
+        pb.portnums_pb2.TRACEROUTE_APP: pb.mesh_pb2.RouteDiscovery,
+    }
+
+    def self_build(self):
+        # serialize the appdata dict back into the protobuf for this portnum
+        port = self.underlayer.portnum  # Underlayer is MeshPayload #pyright: ignore
+        if isinstance(self.appdata, bytes):
+            return self.appdata
+        if port not in self.pb_messages:
+            raise NotImplementedError("This app is not yet supported", port)
+        message = ParseDict(self.appdata, self.pb_messages[port]())
+        return message.SerializeToString()
+
     def do_dissect(self, s):
         port = self.underlayer.portnum  # Underlayer is MeshPacket #pyright: ignore
         self.appname = pb.portnums_pb2.PortNum.Name(port)
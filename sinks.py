@@ -0,0 +1,305 @@
+"""Output sinks for captured LoRaTap frames
+
+A Dispatcher fans each frame out to several sinks in-process. Every sink runs in
+its own thread behind a bounded queue, so a slow consumer (e.g. Wireshark reading
+a named pipe) drops frames instead of stalling the capture or the other sinks.
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+import pcap_utils
+from archive import ArchiveWriter
+from db_tools import Databse
+from record_packets import decode_packet, process_packet
+from scapy_meshtastic import LoRaTap
+
+DROP_POLICIES = ["drop-newest", "drop-oldest", "block"]
+
+
+class Sink:
+    """Base class for frame outputs. open/write/close all run in the sink's thread"""
+
+    name = "sink"
+
+    def open(self):
+        pass
+
+    def write(self, data: bytes, timestamp: float):
+        raise NotImplementedError
+
+    def idle(self):
+        """Called when no frames have arrived for a while"""
+        pass
+
+    def close(self):
+        pass
+
+
+class PcapFileSink(Sink):
+    """Write frames to a pcap file"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.name = f"pcap:{filename}"
+
+    def open(self):
+        self.file = open(self.filename, "wb")
+        self.file.write(pcap_utils.make_header(l2type=270))  # LoRaTap is 270
+
+    def write(self, data: bytes, timestamp: float):
+        self.file.write(pcap_utils.make_packet(data, timestamp))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class StdoutSink(PcapFileSink):
+    """Stream pcap data to stdout, e.g. for piping into wireshark"""
+
+    name = "stdout"
+
+    def __init__(self):
+        pass
+
+    def open(self):
+        self.file = sys.stdout.buffer
+        self.file.write(pcap_utils.make_header(l2type=270))
+        self.file.flush()
+
+
+class NamedPipeSink(PcapFileSink):
+    """Stream pcap data into a named pipe, creating it if needed.
+
+    Opening blocks until a reader connects, frames are queued (or dropped) meanwhile
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.name = f"fifo:{path}"
+
+    def open(self):
+        if not os.path.exists(self.filename):
+            os.mkfifo(self.filename)
+        super().open()
+
+
+class JsonLinesSink(Sink):
+    """Write one decoded packet per line as JSON, in the same shape as the data table"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.name = f"jsonl:{filename}"
+
+    def open(self):
+        self.file = open(self.filename, "a")
+
+    def write(self, data: bytes, timestamp: float):
+        pkt = LoRaTap(data)
+        pkt.time = timestamp
+        packet_data = decode_packet(pkt)
+        if packet_data is not None:
+            self.file.write(json.dumps(packet_data) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SQLiteSink(Sink):
+    """Decode frames and record them to the database like record_packets.py"""
+
+    def __init__(self, filename: str = "database.db"):
+        self.filename = filename
+        self.name = f"sqlite:{filename}"
+
+    def open(self):
+        # sqlite connections can only be used from the thread that made them
+        self.db = Databse(self.filename)
+
+    def write(self, data: bytes, timestamp: float):
+        pkt = LoRaTap(data)
+        pkt.time = timestamp
+        process_packet(pkt, self.db)
+
+    def close(self):
+        self.db.close()
+
+
+class ArchiveSink(Sink):
+    """Add frames to a compressed, indexed frame archive"""
+
+    def __init__(self, path: str, max_age: float = 60):
+        self.path = path
+        self.max_age = max_age
+        self.name = f"archive:{path}"
+
+    def open(self):
+        # the index is sqlite, so the writer has to be made in this thread too
+        # LoRa traffic is slow, so blocks are written by age long before they fill
+        self.writer = ArchiveWriter(self.path, max_age=self.max_age)
+
+    def write(self, data: bytes, timestamp: float):
+        self.writer.add(pcap_utils.make_packet(data, timestamp), timestamp)
+
+    def idle(self):
+        self.writer.flush_expired()
+
+    def close(self):
+        self.writer.close()
+
+
+def sink_from_spec(spec: str) -> Sink:
+    """Create a sink from an output spec.
+
+    "-" is stdout, "fifo:PATH", "sqlite:PATH", "jsonl:PATH" and "archive:PATH" pick a sink type,
+    anything else is a pcap filename
+    """
+    kind, sep, path = spec.partition(":")
+    if spec == "-":
+        return StdoutSink()
+    elif sep and kind == "fifo":
+        return NamedPipeSink(path)
+    elif sep and kind == "sqlite":
+        return SQLiteSink(path)
+    elif sep and kind == "jsonl":
+        return JsonLinesSink(path)
+    elif sep and kind == "archive":
+        return ArchiveSink(path)
+    elif sep and kind == "pcap":
+        return PcapFileSink(path)
+    else:
+        return PcapFileSink(spec)
+
+
+@dataclass
+class SinkStats:
+    received: int = 0
+    written: int = 0
+    dropped: int = 0
+    errors: int = 0
+
+
+class SinkWorker(threading.Thread):
+    """Feeds a sink from its own bounded queue"""
+
+    def __init__(self, sink: Sink, queue_size: int = 1000, policy: str = "drop-newest"):
+        super().__init__(name=sink.name, daemon=True)
+        assert policy in DROP_POLICIES
+        self.sink = sink
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = SinkStats()
+        # stats are updated from both the capture thread and this one
+        self.stats_lock = threading.Lock()
+        self.failed = False
+
+    def count(self, stat: str):
+        with self.stats_lock:
+            setattr(self.stats, stat, getattr(self.stats, stat) + 1)
+
+    def put(self, frame: tuple[bytes, float] | None, timeout: float | None = None):
+        """Queue a frame without blocking the caller, unless policy is "block".
+
+        None marks the end of the stream and always gets queued. With "block" it
+        waits up to timeout for room before making room by dropping the oldest frame
+        """
+        if frame is not None:
+            self.count("received")
+            if self.failed or not self.is_alive():
+                self.count("dropped")
+                return
+        if self.policy == "block":
+            # keep checking the worker so a dead sink can't stall the capture
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.is_alive() and not self.failed:
+                try:
+                    self.queue.put(frame, timeout=0.5)
+                    return
+                except queue.Full:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        break
+            if frame is not None:
+                self.count("dropped")
+                return
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                return
+            except queue.Full:
+                if frame is not None and self.policy == "drop-newest":
+                    self.count("dropped")
+                    return
+            try:
+                self.queue.get_nowait()  # make room by discarding the oldest frame
+                self.count("dropped")
+            except queue.Empty:
+                pass
+
+    def run(self):
+        try:
+            self.sink.open()
+        except Exception as e:
+            print(f"Could not open {self.sink.name}: {e}", file=sys.stderr)
+            self.count("errors")
+            self.failed = True
+        while True:
+            try:
+                frame = self.queue.get(timeout=1)
+            except queue.Empty:
+                if not self.failed:
+                    try:
+                        self.sink.idle()
+                    except Exception as e:
+                        print(f"Error in {self.sink.name}: {e}", file=sys.stderr)
+                        self.count("errors")
+                continue
+            if frame is None:
+                break
+            if self.failed:
+                self.count("dropped")
+                continue
+            try:
+                self.sink.write(*frame)
+                self.count("written")
+            except BrokenPipeError:
+                # reader went away, e.g. wireshark was closed
+                print(f"{self.sink.name} closed, dropping its frames", file=sys.stderr)
+                self.count("errors")
+                self.failed = True
+            except Exception as e:
+                print(f"Error writing to {self.sink.name}: {e}", file=sys.stderr)
+                self.count("errors")
+        if not self.failed:
+            self.sink.close()
+
+
+class Dispatcher:
+    """Fan frames out to several sinks"""
+
+    def __init__(
+        self, sinks: list[Sink], queue_size: int = 1000, policy: str = "drop-newest"
+    ):
+        self.workers = [SinkWorker(sink, queue_size, policy) for sink in sinks]
+        for worker in self.workers:
+            worker.start()
+
+    def dispatch(self, data: bytes, timestamp: float):
+        for worker in self.workers:
+            worker.put((data, timestamp))
+
+    def close(self, timeout: float | None = None):
+        """Flush and close every sink. Sinks still waiting on a reader are abandoned"""
+        for worker in self.workers:
+            worker.put(None, timeout)
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def stats(self) -> dict[str, SinkStats]:
+        return {worker.sink.name: worker.stats for worker in self.workers}
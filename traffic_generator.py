@@ -0,0 +1,321 @@
+import argparse
+import datetime
+import os
+import random
+import select
+import sys
+import time
+import tty
+
+import pcap_utils
+from scapy_meshtastic import LoRaTap, MeshApp, MeshPacket, MeshPayload, MeshText, pb
+
+parser = argparse.ArgumentParser(
+    description="Generates synthetic meshtastic traffic for load testing the capture pipeline."
+)
+parser.add_argument(
+    "-m",
+    "--mode",
+    choices=["pcap", "mqtt", "pty"],
+    default="pcap",
+    help="Where to send frames: a pcap file/stream, an MQTT broker, or a pty emulating the LoRa sniffer.",
+)
+parser.add_argument(
+    "-o",
+    "--out",
+    dest="outfile",
+    help="pcap output location. Defaults to timestamped pcap files. Supports '-' for stdout.",
+)
+parser.add_argument(
+    "-r",
+    "--rate",
+    type=float,
+    default=0,
+    help="Target packets per second. 0 sends as fast as possible.",
+)
+parser.add_argument(
+    "-n",
+    "--count",
+    type=int,
+    default=1000,
+    help="Number of packets to send, including rebroadcasts. 0 runs until interrupted.",
+)
+parser.add_argument("--nodes", type=int, default=20, help="Number of simulated nodes.")
+parser.add_argument(
+    "--portnums",
+    default="TEXT_MESSAGE_APP:1,POSITION_APP:3,TELEMETRY_APP:4,NODEINFO_APP:2",
+    help="Traffic mix as comma-separated PORTNUM:weight pairs.",
+)
+parser.add_argument(
+    "--hop-start", type=int, default=3, help="Hop limit new packets start with (0-7)."
+)
+parser.add_argument(
+    "--rebroadcast",
+    type=float,
+    default=0.5,
+    help="Chance (0-1) that each hop of a packet is heard again as a rebroadcast.",
+)
+parser.add_argument(
+    "--direct",
+    type=float,
+    default=0.1,
+    help="Fraction of packets sent to a single node instead of broadcast.",
+)
+parser.add_argument(
+    "--pool",
+    type=int,
+    default=500,
+    help="Number of unique packets to pre-build and replay, so scapy doesn't limit the rate.",
+)
+parser.add_argument("--seed", type=int, help="Random seed for reproducible traffic.")
+parser.add_argument("--mqtt-host", default="localhost", help="MQTT broker hostname.")
+parser.add_argument("--mqtt-port", type=int, default=1883, help="MQTT broker port.")
+parser.add_argument(
+    "--mqtt-topic",
+    default="msh/US/2/e/LongFast",
+    help="Topic prefix, the gateway id is appended like real gateways do.",
+)
+
+BROADCAST = 0xFFFFFFFF
+EOF_BYTES = b"\xcf\xcf"  # custom EOF bytes, must match arduino code
+
+
+def parse_mix(mix: str) -> dict[int, float]:
+    """Turn "PORTNUM:weight,..." into a {portnum: weight} dict"""
+    weights = {}
+    for entry in mix.split(","):
+        name, _, weight = entry.partition(":")
+        port = pb.portnums_pb2.PortNum.Value(name.strip())
+        if port != pb.portnums_pb2.TEXT_MESSAGE_APP and port not in MeshApp.pb_messages:
+            raise ValueError(f"Can't generate {name} packets")
+        weights[port] = float(weight or 1)
+    return weights
+
+
+def make_node(rng: random.Random) -> dict:
+    node_id = rng.getrandbits(32) & 0xFFFFFFFE  # avoid the broadcast address
+    return {
+        "id": node_id,
+        "name": "!" + hex(node_id)[2:],
+        "lat": rng.uniform(39.8, 40.1),
+        "lon": rng.uniform(-75.3, -75.0),
+        "battery": rng.randint(20, 100),
+    }
+
+
+def make_app(port: int, node: dict, rng: random.Random) -> MeshApp | MeshText:
+    """Build the application layer for a portnum with plausible contents"""
+    now = int(time.time())
+    if port == pb.portnums_pb2.TEXT_MESSAGE_APP:
+        text = f"test message {rng.getrandbits(16)} from {node['name']}"
+        return MeshText(appdata=text.encode())
+    elif port == pb.portnums_pb2.NODEINFO_APP:
+        appdata = {
+            "id": node["name"],
+            "longName": f"Load Test {node['name'][-4:]}",
+            "shortName": node["name"][-4:],
+            "hwModel": "TBEAM",
+        }
+    elif port == pb.portnums_pb2.POSITION_APP:
+        node["lat"] += rng.uniform(-0.001, 0.001)
+        node["lon"] += rng.uniform(-0.001, 0.001)
+        appdata = {
+            "latitudeI": int(node["lat"] * 1e7),
+            "longitudeI": int(node["lon"] * 1e7),
+            "altitude": rng.randint(0, 150),
+            "time": now,
+        }
+    elif port == pb.portnums_pb2.TELEMETRY_APP:
+        node["battery"] = max(0, node["battery"] - rng.randint(0, 1))
+        appdata = {
+            "time": now,
+            "deviceMetrics": {
+                "batteryLevel": node["battery"],
+                "voltage": 3.3 + node["battery"] / 100,
+                "channelUtilization": rng.uniform(0, 30),
+                "airUtilTx": rng.uniform(0, 5),
+                "uptimeSeconds": rng.randint(0, 1_000_000),
+            },
+        }
+    else:
+        # traceroute, store and forward etc. are fine with empty messages
+        appdata = {}
+    return MeshApp(appdata=appdata)
+
+
+def make_frames(args, nodes: list[dict], sender: dict, port: int, dst: int, rng):
+    """Build one original packet plus the rebroadcasts heard for it.
+
+    Frames are (loratap_bytes, meshpacket) tuples. Rebroadcasts reuse the encrypted
+    payload with a lower hop_limit and a new relay_node, the same as the firmware.
+    """
+    mesh = MeshPacket(
+        dst=dst,
+        src=sender["id"],
+        packet_id=rng.getrandbits(32),
+        hop_limit=args.hop_start,
+        hop_start=args.hop_start,
+        want_ack=int(dst != BROADCAST),
+        channel_hash=0x08,  # LongFast with the default key
+        next_hop=0,
+        relay_node=sender["id"] & 0xFF,
+    )
+    payload = MeshPayload(portnum=port) / make_app(port, sender, rng)
+
+    frames = []
+    hop_limit = args.hop_start
+    relay = sender
+    while True:
+        mesh.hop_limit = hop_limit
+        mesh.relay_node = relay["id"] & 0xFF
+        frame = (
+            LoRaTap(
+                lt_length=15,
+                frequency=906875000,
+                bandwidth=2,
+                sf=11,
+                packet_rssi=rng.randint(40, 120),
+                max_rssi=0xFF,
+                current_rssi=rng.randint(20, 40),
+                snr=rng.randint(-40, 40) & 0xFF,
+            )
+            / mesh.copy()
+            / payload.copy()
+        )
+        frames.append((bytes(frame), frame[MeshPacket]))
+        if hop_limit == 0 or rng.random() >= args.rebroadcast:
+            break
+        hop_limit -= 1
+        relay = rng.choice(nodes)
+    return frames
+
+
+def build_pool(args) -> list[tuple[bytes, MeshPacket]]:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.portnums)
+    nodes = [make_node(rng) for _ in range(args.nodes)]
+    pool = []
+    # every node announces itself first, like a freshly booted mesh
+    if pb.portnums_pb2.NODEINFO_APP in mix:
+        for node in nodes:
+            pool += make_frames(
+                args, nodes, node, pb.portnums_pb2.NODEINFO_APP, BROADCAST, rng
+            )
+    while len(pool) < args.pool:
+        sender = rng.choice(nodes)
+        port = rng.choices(list(mix.keys()), weights=list(mix.values()))[0]
+        if rng.random() < args.direct:
+            others = [node for node in nodes if node is not sender] or nodes
+            dst = rng.choice(others)["id"]
+        else:
+            dst = BROADCAST
+        pool += make_frames(args, nodes, sender, port, dst, rng)
+    return pool
+
+
+def service_envelope(mesh: MeshPacket, gateway: str) -> bytes:
+    """Wrap a frame in the protobuf that gateways publish to MQTT"""
+    envelope = pb.mqtt_pb2.ServiceEnvelope(channel_id="LongFast", gateway_id=gateway)
+    packet = envelope.packet
+    packet.to = mesh.dst
+    setattr(packet, "from", mesh.src)  # need to do this since from is a reserved word
+    packet.id = mesh.packet_id
+    packet.channel = mesh.channel_hash
+    packet.hop_limit = mesh.hop_limit
+    packet.hop_start = mesh.hop_start
+    packet.want_ack = bool(mesh.want_ack)
+    packet.encrypted = bytes(mesh[MeshPayload])
+    return envelope.SerializeToString()
+
+
+def open_pty() -> int:
+    """Open a pseudo-terminal that pcap_writer.py can use as a serial port"""
+    master, slave = os.openpty()
+    tty.setraw(slave)  # no newline translation on binary data
+    print(f"Emulating LoRa sniffer on {os.ttyname(slave)}", file=sys.stderr)
+    print(f"  python pcap_writer.py -p {os.ttyname(slave)} -o -", file=sys.stderr)
+    os.set_blocking(master, False)
+    return master
+
+
+def write_pty(master: int, data: bytes) -> bool:
+    """Write to the pty without blocking, like a serial port overrunning.
+
+    Returns False if the reader is too slow and the frame was dropped
+    """
+    try:
+        written = os.write(master, data)
+    except BlockingIOError:
+        return False
+    # never leave half a frame in the buffer
+    while written < len(data):
+        select.select([], [master], [])
+        written += os.write(master, data[written:])
+    return True
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    print("Building packets", file=sys.stderr)
+    pool = build_pool(args)
+
+    # handle outputs
+    if args.mode == "pcap":
+        if args.outfile == "-":  # want stdout
+            out = sys.stdout.buffer
+        else:
+            outfile = (
+                args.outfile
+                or f"generated-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.pcap"
+            )
+            out = open(outfile, "wb")
+        out.write(pcap_utils.make_header(l2type=270))  # LoRaTap is link-layer type 270
+        out.flush()
+    elif args.mode == "mqtt":
+        import paho.mqtt.client as mqtt
+
+        mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        mqttc.connect(args.mqtt_host, args.mqtt_port)
+        mqttc.loop_start()
+        gateway = "!" + hex(random.Random(args.seed).getrandbits(32))[2:]
+        topic = f"{args.mqtt_topic}/{gateway}"
+        envelopes = [service_envelope(mesh, gateway) for _, mesh in pool]
+    else:
+        master = open_pty()
+
+    sent = 0
+    dropped = 0
+    start = time.monotonic()
+    try:
+        while args.count == 0 or sent + dropped < args.count:
+            if args.rate:
+                # schedule against the start time so sleep jitter doesn't accumulate
+                delay = start + (sent + dropped) / args.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            index = (sent + dropped) % len(pool)
+            data = pool[index][0]
+            if args.mode == "pcap":
+                out.write(pcap_utils.make_packet(data))
+                out.flush()
+            elif args.mode == "mqtt":
+                mqttc.publish(topic, envelopes[index])
+            elif not write_pty(master, data + EOF_BYTES):
+                dropped += 1
+                continue
+            sent += 1
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        elapsed = time.monotonic() - start
+        print(
+            f"Sent {sent} packets in {elapsed:.2f}s ({sent / max(elapsed, 1e-9):.1f} pkt/s)",
+            file=sys.stderr,
+        )
+        if dropped:
+            print(f"Dropped {dropped} packets, reader too slow", file=sys.stderr)
+        if args.mode == "mqtt":
+            mqttc.loop_stop()
+            mqttc.disconnect()